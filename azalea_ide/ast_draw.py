@@ -1,73 +1,102 @@
 import graphviz as gviz
 import matplotlib.pyplot as plt
 import json
+from pathlib import Path
 
 
-ast_dict = None
-ast_str  = None
-with open("../ast_dump/ast.json", "r") as ast_json:
-    ast_dict = json.load(ast_json)
-    ast_str  = json.dumps(ast_dict, indent=2)
+def load_ast(path):
+    with open(path, "r") as ast_json:
+        return json.load(ast_json)
 
 
-G2 = gviz.Digraph(strict=True)
+G2 = gviz.Digraph(strict=True, engine="dot")
 
+# Last attributes written for each node, and every edge already emitted.
+# Graphviz appends a DOT statement per call, so repeats only bloat the body.
+_styled_nodes = {}
+_edges        = set()
 
-def walk_list(key, lis):
-    for i in lis:
-        if isinstance(i, dict):
-            walk_dict(key, i)
-        elif isinstance(i, str):
-            G2.edge(key,i)
-        elif i == None:
-            G2.node(key, "null")
-        else:
-            walk_list(key, i)
 
+def _node(name, label=None, **attrs):
+    style = (label, tuple(sorted(attrs.items())))
+    if _styled_nodes.get(name) == style:
+        return
+    _styled_nodes[name] = style
+    G2.node(name, label, **attrs)
 
-def walk_dict(key, diction):
-        for j, value in diction.items():
+
+def _edge(tail, head):
+    if (tail, head) in _edges:
+        return
+    _edges.add((tail, head))
+    G2.edge(tail, head)
+
+
+def _children(parent, container):
+    # Work items for everything directly inside `container`. They are
+    # reversed so popping them off the stack keeps the document order.
+    if isinstance(container, dict):
+        return [("dict", parent, j, value) for j, value in reversed(container.items())]
+    return [("list", parent, None, i) for i in reversed(container)]
+
+
+def walk(node):
+    # Iterative walk over the AST. Each work item is (kind, key, j, value),
+    # where `kind` says whether `value` was found in the root object, in a
+    # list hanging off `key`, or under field `j` of a dict hanging off `key`.
+    stack = [("root", None, key, item) for key, item in reversed(node.items())]
+
+    while stack:
+        kind, key, j, value = stack.pop()
+
+        if kind == "root":
+            if isinstance(value, (list, dict)):
+                stack.extend(_children(j, value))
+            elif isinstance(value, str):
+                _node(j, value)
+            # elif value == None:
+                # _edge(j, "null")
+
+        elif kind == "list":
             if isinstance(value, dict):
-                G2.node(key, color="lightblue", style="filled")
-                G2.node(j, color="lightblue", style="filled")
-                G2.edge(key, j)
-                walk_dict(j, value)
+                stack.extend(_children(key, value))
             elif isinstance(value, str):
-                G2.node(key, color="lightblue", style="filled")
-                G2.node(value, color="maroon", style="filled")
-                print(key, j)
-                print(j, value)
-                if str(j) == "raw_content":
-                    G2.edge(key, value)
-                else:
-                    G2.node(j, color="lightgreen", style="filled")
-                    G2.edge(key, j)
-                    G2.edge(j, value)
-
-
-            elif isinstance(value, list):
-                print(key)
-                G2.edge(key, j)
-                walk_list(j, value)
+                _edge(key, value)
             elif value == None:
-                G2.edge(key, j)
-                G2.node(j, color="grey", style="filled")
+                _node(key, "null")
+            else:
+                stack.extend(_children(key, value))
 
+        elif isinstance(value, dict):
+            _node(key, color="lightblue", style="filled")
+            _node(j, color="lightblue", style="filled")
+            _edge(key, j)
+            stack.extend(_children(j, value))
+        elif isinstance(value, str):
+            _node(key, color="lightblue", style="filled")
+            _node(value, color="maroon", style="filled")
+            if str(j) == "raw_content":
+                _edge(key, value)
+            else:
+                _node(j, color="lightgreen", style="filled")
+                _edge(key, j)
+                _edge(j, value)
+        elif isinstance(value, list):
+            _edge(key, j)
+            stack.extend(_children(j, value))
+        elif value == None:
+            _edge(key, j)
+            _node(j, color="grey", style="filled")
 
-def walk(node):
-    for key, item in node.items():
-        if isinstance(item, list):
-            walk_list(key, item)
-        if isinstance(item, dict):
-            walk_dict(key, item)
-        elif isinstance(item,str):
-            G2.node(key,item)
-        # elif item == None:
-            # G2.edge(key, "null")
-    
     return G2
 
-ast_graph   = walk(ast_dict)
-print(ast_graph)
-ast_graph.render(directory="../ast_dump/")
+if __name__ == "__main__":
+    ast_dict    = load_ast("../ast_dump/ast.json")
+    ast_graph   = walk(ast_dict)
+    print(ast_graph)
+
+    # Pipe the DOT source straight through `dot` instead of writing it to
+    # disk first and rendering from there
+    svg = ast_graph.pipe(format="svg", quiet=True)
+    Path("../ast_dump/ast.svg").write_bytes(svg)
 
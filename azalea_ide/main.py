@@ -1,6 +1,6 @@
 #!/usr/bin/python
 
-import sys, os, subprocess 
+import sys, os
 from pathlib import Path
 from PyQt6.QtWidgets import (
     QMainWindow,
@@ -14,12 +14,86 @@ from PyQt6.QtWidgets import (
     QPushButton,
     QMessageBox,
 )
-from PyQt6.QtGui import QIcon, QAction, QFont, QFontMetricsF
+from PyQt6.QtGui import (
+    QIcon,
+    QAction,
+    QColor,
+    QFont,
+    QFontDatabase,
+    QFontMetricsF,
+    QSyntaxHighlighter,
+    QTextCharFormat,
+)
+from PyQt6.QtCore import QProcess, QTimer
 from qt_material import apply_stylesheet
 from ansi2html import Ansi2HTMLConverter
-from pygments import highlight
 from pygments.lexers import RustLexer
-from pygments.formatters import Terminal256Formatter
+from pygments.styles import get_style_by_name
+from pygments.token import Comment, String
+
+
+# Ansi code to html converter for the compiler output. Inline styles mean
+# the html needs no stylesheet header to keep its colors.
+_ANSI_CONV = Ansi2HTMLConverter(latex=False, inline=True)
+
+# Pygments setup is costly (the lexer compiles its regexes on first use),
+# so build it once instead of on every highlight
+_RUST_LEXER = RustLexer(stripnl=False, ensurenl=False)
+
+
+class RustHighlighter(QSyntaxHighlighter):
+    def __init__(self, document):
+        super(RustHighlighter, self).__init__(document)
+
+        # Build the Qt format for every token type in the style up front, so
+        # highlighting a line is just a lookup per token
+        self.formats = {}
+        for ttype, style in get_style_by_name("github-dark"):
+            fmt = QTextCharFormat()
+            if style["color"]:
+                fmt.setForeground(QColor(f"#{style['color']}"))
+            if style["bold"]:
+                fmt.setFontWeight(QFont.Weight.Bold)
+            if style["italic"]:
+                fmt.setFontItalic(True)
+            if style["underline"]:
+                fmt.setFontUnderline(True)
+
+            self.formats[ttype] = fmt
+
+    def tokenFormat(self, ttype):
+        # Token types the style doesn't list use their parent's format
+        while ttype not in self.formats:
+            ttype = ttype.parent
+
+        return self.formats[ttype]
+
+    def highlightBlock(self, text):
+        # Qt calls this per line, and only for lines that actually changed.
+        # Block comments nest and can span lines, so each line's state is the
+        # comment depth it ends at (doubled, low bit set for doc comments).
+        # The next line resumes lexing from there, and Qt re-highlights the
+        # following lines whenever a line's state changes.
+        state      = max(self.previousBlockState(), 0)
+        depth, doc = state >> 1, state & 1
+        stack      = ["root"] + ["doccomment" if doc else "comment"] * depth
+
+        # Qt hands us the line without its newline, but the lexer's rules for
+        # `//` comments and a trailing `/**` only match up to one. Formats
+        # past the end of the line are clipped by Qt, so adding it is safe.
+        for start, ttype, value in _RUST_LEXER.get_tokens_unprocessed(text + "\n", stack=stack):
+            self.setFormat(start, len(value), self.tokenFormat(ttype))
+
+            if ttype == Comment.Multiline or ttype == String.Doc:
+                if value.startswith("/*"):
+                    if depth == 0:
+                        doc = int(ttype == String.Doc)
+                    depth += 1
+                elif value == "*/":
+                    depth -= 1
+
+        self.setCurrentBlockState(depth * 2 + doc if depth else 0)
+
 
 class AzaleaIde(QMainWindow):
     def __init__(self):
@@ -27,44 +101,16 @@ class AzaleaIde(QMainWindow):
 
         self.sourceFileData = None
         self.sourceFilePath = None
-        self.fullyLoaded    = False
-
-        self.initUI()
-
-    
-    def updateHighlighting(self):
-        if self.fullyLoaded:
-            content = self.playground.toPlainText()
-
-            print(content)
-            
-            # We block signals to prevent stack overflow. 
-            # If we didn't, typing would recursively call `updateHighlighting`.
-            self.playground.blockSignals(True)
-
-            # Add syntax highlighting to file 
-            ansi_content = highlight(content, 
-                                     RustLexer(), 
-                                     Terminal256Formatter(style="github-dark"))
-
-            ansi_content = ansi_content.rstrip()
 
-            # Convert ANSI colors to QT html 
-            ansiConverter = Ansi2HTMLConverter(latex=False)
-            html_content  = ansiConverter.convert(ansi_content, ensure_trailing_newline=False)
-
-            pos = self.playground.textCursor().position()
-
-            # Write loaded source file to playground 
-            self.playground.clear()
-            self.playground.appendHtml(html_content)
-            cursor = self.playground.textCursor()
-            cursor.setPosition(min(pos, len(self.playground.toPlainText())))
-            self.playground.setTextCursor(cursor)
-            self.playground.blockSignals(False)
+        # Directory the open file dialog starts in
+        self.workingDirectory = os.getcwd()
 
+        # Compiler output that hasn't been written to the terminal output yet
+        self.compilerOutput = bytearray()
 
+        self.initUI()
 
+    
     def saveFileHandler(self):
 
         # Make sure we open a source file first before saving
@@ -76,8 +122,7 @@ class AzaleaIde(QMainWindow):
         self.sourceFileData = self.playground.toPlainText()
 
         # Save current playground work back to disk
-        with open(self.sourceFilePath, "w") as sourceFile:
-            sourceFile.write(self.sourceFileData)
+        self.sourceFilePath.write_text(self.sourceFileData, encoding="utf-8")
 
     def compileAndRunHandler(self):
         
@@ -86,34 +131,91 @@ class AzaleaIde(QMainWindow):
             QMessageBox.critical(self, "Attention", "Make sure to open a file first.")
             return 
 
-        # Run Morehead Azalea Compiler on source file and get console output
-        compilerProcess = subprocess.Popen(["compiler/debug/mlc", "--source-path", f"{self.sourceFilePath}"], stdout=subprocess.PIPE,
-                                            stderr=subprocess.PIPE, text=True)
-        compilerOutput, _err = compilerProcess.communicate()
+        # Start fresh for this run and don't allow overlapping runs
+        self.termOutput.clear()
+        self.compilerOutput.clear()
+        self.compilerOutputTimer.stop()
+        self.compileAndRunBtn.setEnabled(False)
 
-        # Create an ansi code to html converter. 
-        # We use this to properly display Azalea's compiler output
-        ansiConverter = Ansi2HTMLConverter(latex=False)
-        
-        # Clean the compiler output to remove ansi color codes
-        htmlCompilerOutput = ansiConverter.convert(compilerOutput)
+        # Run Morehead Azalea Compiler on source file
+        self.compilerProcess.start("compiler/debug/mlc", ["--source-path", f"{self.sourceFilePath}"])
 
-        # Write compiler output to the terminal output text widget
-        self.termOutput.clear()
-        self.termOutput.appendHtml(htmlCompilerOutput)
+    def compilerOutputHandler(self):
+        self.compilerOutput += self.compilerProcess.readAllStandardOutput().data()
+
+        # Chatty compilers write in many small pieces. Collect them and only
+        # write to the terminal output every so often, since each append
+        # costs a layout pass.
+        if not self.compilerOutputTimer.isActive():
+            self.compilerOutputTimer.start()
+
+    def flushCompilerOutput(self):
+        # Only write out complete lines. The rest waits for the next flush so
+        # we never split a line (or a multi-byte character) in two.
+        end = self.compilerOutput.rfind(b"\n")
+        if end != -1:
+            self.writeCompilerOutput(self.compilerOutput[:end])
+            del self.compilerOutput[:end + 1]
+
+    def compilerFinishedHandler(self):
+        self.compilerOutputTimer.stop()
+        self.compilerOutput += self.compilerProcess.readAllStandardOutput().data()
+        self.flushCompilerOutput()
+
+        # Whatever is left is a last line without a trailing newline
+        if self.compilerOutput:
+            self.writeCompilerOutput(self.compilerOutput)
+            self.compilerOutput.clear()
+
+        self.compileAndRunBtn.setEnabled(True)
+
+    def compilerErrorHandler(self, error):
+        # A process that never started won't emit `finished`
+        if error == QProcess.ProcessError.FailedToStart:
+            QMessageBox.critical(self, "Attention", "Could not start the Azalea compiler.")
+            self.compileAndRunBtn.setEnabled(True)
+
+    def writeCompilerOutput(self, output):
+        compilerOutput = output.decode("utf-8", errors="replace")
+
+        # Output without any escape codes can skip ansi2html and Qt's html
+        # parser altogether. A substring test is much cheaper than a regex.
+        if "\x1b" not in compilerOutput:
+            self.termOutput.appendPlainText(compilerOutput)
+            return
+
+        # Convert the compiler's ansi colors to html for the terminal output.
+        # Only the converted fragment is needed, not a whole html document.
+        htmlCompilerOutput = _ANSI_CONV.convert(compilerOutput, full=False)
+
+        self.termOutput.appendHtml(f"<pre>{htmlCompilerOutput}</pre>")
 
 
 
     def openFileHandler(self):
         # File dialog box for open Logic
-        currentDirectory = os.getcwd()
-        self.fileDialog = QFileDialog(
-            self, "Open Source File", currentDirectory, "Source Files (*.txt *.la)"
+        sourceFilePath, _ = QFileDialog.getOpenFileName(
+            self, "Open Source File", self.workingDirectory, "Source Files (*.az *.txt *.la)"
         )
 
+        # If user clicks "cancel", just skip opening file
+        if not sourceFilePath:
+            return
+
         # Unwrap source file path
-        self.sourceFilePath = Path(self.fileDialog.getOpenFileName()[0])
-        print(type(self.sourceFilePath))
+        sourceFilePath = Path(sourceFilePath)
+
+        # Read source file out. Only UTF-8 is supported, and we refuse the
+        # file rather than mangle bytes that saving would write back.
+        try:
+            content = sourceFilePath.read_bytes().decode("utf-8")
+        except UnicodeDecodeError:
+            QMessageBox.critical(self, 
+                                 "Attention", 
+                                 f"`{sourceFilePath.name}` is not valid UTF-8 and can't be opened.")
+            return
+
+        self.sourceFilePath = sourceFilePath
 
         if self.sourceFilePath.suffix != ".az":
             file_name = self.sourceFilePath.name
@@ -121,29 +223,12 @@ class AzaleaIde(QMainWindow):
                                 "Alert", 
                                 f"Since `{file_name}` does not end with `.az`, it won't compile!")
 
-
-        # If user clicks "cancel", just skip opening file
-        if self.sourceFilePath != "":
-            # Read source file out into the `codePlayground` text box
-            with open(self.sourceFilePath, "r") as sourceFile:
-                content = sourceFile.read()
-
-                # Add syntax highlighting to file 
-                ansi_content = highlight(content, 
-                                         RustLexer(stripnl=False, ensurenl=False), 
-                                         Terminal256Formatter(style="github-dark"))
+        # Keep track of loaded file 
+        self.sourceFileData = content
         
-                # Convert ANSI colors to QT html 
-                ansiConverter = Ansi2HTMLConverter(latex=False)
-                html_content  = ansiConverter.convert(ansi_content)
-
-                # Keep track of loaded file 
-                self.sourceFileData = content
-                
-                # Write loaded source file to playground 
-                self.playground.clear()
-                self.playground.appendHtml(html_content)
-                self.fullyLoaded = True
+        # Write loaded source file to the `codePlayground` text box.
+        # The highlighter colors it.
+        self.playground.setPlainText(content)
 
     def openInfoHandler(self):
         infoMsg = " Author: Dalton Hensley\n Program: Azalea IDE\n" \
@@ -197,9 +282,23 @@ class AzaleaIde(QMainWindow):
         fileMenu.addAction(infoAct)
 
         # Add a button to run compiler on file and run program
-        compileAndRunBtn = QPushButton("Compile and Run")
-        compileAndRunBtn.clicked.connect(self.compileAndRunHandler)
-        compileAndRunBtn.setMaximumWidth(160)
+        self.compileAndRunBtn = QPushButton("Compile and Run")
+        self.compileAndRunBtn.clicked.connect(self.compileAndRunHandler)
+        self.compileAndRunBtn.setMaximumWidth(160)
+
+        # Process for the Morehead Azalea Compiler, reused for every run. Its
+        # console output (stderr included) is streamed into the terminal
+        # output as it arrives instead of freezing the UI.
+        self.compilerProcess = QProcess(self)
+        self.compilerProcess.setProcessChannelMode(QProcess.ProcessChannelMode.MergedChannels)
+        self.compilerProcess.readyReadStandardOutput.connect(self.compilerOutputHandler)
+        self.compilerProcess.finished.connect(self.compilerFinishedHandler)
+        self.compilerProcess.errorOccurred.connect(self.compilerErrorHandler)
+
+        self.compilerOutputTimer = QTimer(self)
+        self.compilerOutputTimer.setSingleShot(True)
+        self.compilerOutputTimer.setInterval(50)
+        self.compilerOutputTimer.timeout.connect(self.flushCompilerOutput)
 
         # Add helpful status bar in bottom left corner
         statusBar = QStatusBar(self)
@@ -207,18 +306,26 @@ class AzaleaIde(QMainWindow):
 
         # Add input text box for writing code
         self.playground = QPlainTextEdit("")
+        self.playground.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
         self.playground.setTabStopDistance(
         QFontMetricsF(self.playground.font()).horizontalAdvance(' ') * 6)
-        self.playground.textChanged.connect(self.updateHighlighting)
+
+        # Syntax highlighting. Qt re-highlights only the lines that change.
+        self.highlighter = RustHighlighter(self.playground.document())
 
         # Add output text box for terminal output
         self.termOutput = QPlainTextEdit("")
         self.termOutput.setMaximumHeight(400)
         self.termOutput.setEnabled(True)
 
+        # Keep a rolling window of compiler output so long sessions don't
+        # slow down every append. Nobody needs to undo in the output pane.
+        self.termOutput.setMaximumBlockCount(5000)
+        self.termOutput.setUndoRedoEnabled(False)
+
         # Add above widgets to the vertical layout
         layout.addWidget(menubar)
-        layout.addWidget(compileAndRunBtn)
+        layout.addWidget(self.compileAndRunBtn)
         layout.addWidget(self.playground)
         layout.addWidget(self.termOutput)
 